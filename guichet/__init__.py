@@ -1 +1 @@
-from guichet.guichet import Guichet
+from guichet.guichet import Guichet, sync
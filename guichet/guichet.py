@@ -1,11 +1,220 @@
 import inspect
+import sys
+import threading
 import traceback
-from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from tkinter import TclError
+from types import FunctionType, MappingProxyType
 from typing import Callable, Literal, get_args, get_origin
+from weakref import WeakKeyDictionary
 
 import PySimpleGUI as sg
 from pydantic import SecretStr
 
+_EMPTY = inspect.Parameter.empty
+
+
+def _make_input_text(key, annotation, default, show_default):
+    return sg.InputText(default_text=default if show_default else "", key=key)
+
+
+def _make_password_input(key, annotation, default, show_default):
+    return sg.InputText(
+        default_text=default if show_default else "", key=key, password_char="*"
+    )
+
+
+def _make_checkbox(key, annotation, default, show_default):
+    kwargs = {"default": default} if show_default else {}
+    return sg.Checkbox(text="", key=key, **kwargs)
+
+
+def _make_combo(key, annotation, default, show_default):
+    kwargs = {"default_value": default} if show_default else {}
+    return sg.Combo(values=get_args(annotation), key=key, **kwargs)
+
+
+# Functions that create the control of a parameter according to its annotation. Any
+# annotation missing here gets a text input.
+_TYPE_MAP = MappingProxyType(
+    {
+        int: _make_input_text,
+        float: _make_input_text,
+        str: _make_input_text,
+        bool: _make_checkbox,
+        SecretStr: _make_password_input,
+        Literal: _make_combo,
+    }
+)
+
+
+# Weakly keyed so that caching a function does not keep it (and its closure) alive
+_params_cache = WeakKeyDictionary()
+
+
+def _function_params(function):
+    """Returns a `(name, annotation, default, has_default)` tuple for each parameter
+    of `function`. `annotation` is `None` if there is none."""
+    try:
+        return _params_cache[function]
+    except KeyError:
+        params = _params_cache[function] = _introspect_params(function)
+        return params
+    except TypeError:
+        # Not hashable or not weak-referenceable
+        return _introspect_params(function)
+
+
+def _introspect_params(function):
+    if (
+        type(function) is FunctionType
+        and not hasattr(function, "__wrapped__")
+        and not hasattr(function, "__signature__")
+    ):
+        return _code_params(function)
+
+    return tuple(
+        (
+            p.name,
+            p.annotation if p.annotation is not _EMPTY else None,
+            p.default,
+            p.default is not _EMPTY,
+        )
+        for p in inspect.signature(function).parameters.values()
+    )
+
+
+def _code_params(function):
+    # Same output as going through `inspect.signature`, but read straight from the
+    # code object of a plain function, which is considerably faster
+    code = function.__code__
+    annotations = function.__annotations__
+    names = code.co_varnames
+    n_args = code.co_argcount
+    n_kwonly = code.co_kwonlyargcount
+    defaults = function.__defaults__ or ()
+    kwdefaults = function.__kwdefaults__ or {}
+
+    params = []
+    first_default = n_args - len(defaults)
+    for i, name in enumerate(names[:n_args]):
+        if i >= first_default:
+            params.append(
+                (name, annotations.get(name), defaults[i - first_default], True)
+            )
+        else:
+            params.append((name, annotations.get(name), _EMPTY, False))
+
+    index = n_args + n_kwonly
+    if code.co_flags & inspect.CO_VARARGS:
+        params.append((names[index], annotations.get(names[index]), _EMPTY, False))
+        index += 1
+
+    for name in names[n_args : n_args + n_kwonly]:
+        default = kwdefaults.get(name, _EMPTY)
+        params.append((name, annotations.get(name), default, default is not _EMPTY))
+
+    if code.co_flags & inspect.CO_VARKEYWORDS:
+        params.append((names[index], annotations.get(names[index]), _EMPTY, False))
+
+    return tuple(params)
+
+
+def _converter(annotation):
+    """Returns the callable that converts a control value according to
+    `annotation`, or `None` if the control already yields a value of that type."""
+    if annotation in (None, str, bool) or get_origin(annotation) == Literal:
+        return None
+    return annotation if callable(annotation) else None
+
+
+def _convert_args(converter_pairs, values):
+    """Converts the values read from the window according to the parameter
+    annotations. Values that can't be converted are passed as they are."""
+    kwargs = {}
+    positional = None
+    for i, (name, convert) in enumerate(converter_pairs):
+        if name in values:
+            v = values[name]
+        else:
+            # Inputs of customized layouts may lack the parameter name as key, in
+            # which case they are matched by position
+            if positional is None:
+                positional = list(values.values())
+            if i >= len(positional):
+                raise KeyError(
+                    f"The layout has no input for parameter '{name}'. Give it the "
+                    f"key '{name}'."
+                )
+            v = positional[i]
+        if convert is None:
+            kwargs[name] = v
+            continue
+        try:
+            kwargs[name] = convert(v)
+        except (TypeError, ValueError):
+            kwargs[name] = v
+    return kwargs
+
+
+def sync(function: Callable) -> Callable:
+    """Marks a function to be run in the GUI's thread.
+
+    Use it for a `main_function` that interacts with the GUI directly, for instance
+    opening popups, as that is not safe from another thread.
+
+    Args:
+        function (Callable): The function to be marked.
+
+    Returns:
+        Callable: The same function.
+    """
+    function._guichet_sync = True
+    return function
+
+
+def _is_sync(function):
+    return getattr(function, "_guichet_sync", False)
+
+
+def _find_element(layout, key):
+    for row in layout:
+        for element in row:
+            if getattr(element, "Key", None) == key:
+                return element
+    return None
+
+
+class _OutputWriter:
+    """File-like object that collects text written to it and appends it to a
+    `sg.Multiline` from the GUI's thread.
+
+    Text written in quick succession, such as many `print` calls in a row, is appended
+    to the element in a single update.
+    """
+
+    def __init__(self, guichet, element):
+        self._guichet = guichet
+        self._element = element
+        self._chunks = []
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._chunks.append(text)
+            first = len(self._chunks) == 1
+        if first:
+            self._guichet.post(self._append_to_element)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def _append_to_element(self):
+        with self._lock:
+            chunks, self._chunks = self._chunks, []
+        self._element.update("".join(chunks), append=True)
+
 
 class Guichet:
     """Represents an automatically generated Graphical User Interface (GUI).
@@ -15,15 +224,6 @@ class Guichet:
     function and any outputs are displayed in a text field.
     """
 
-    _TYPE_MAP = {
-        int: sg.InputText,
-        float: sg.InputText,
-        str: sg.InputText,
-        bool: sg.Checkbox,
-        SecretStr: (sg.InputText, {"password_char": "*"}),
-        Literal: sg.Combo,
-    }
-
     def __init__(
         self,
         main_function: Callable,
@@ -34,7 +234,7 @@ class Guichet:
         show_default: bool = True,
         ignore_params: list = None,
         redirect_stdout: bool = True,
-        run_in_new_thread: bool = False,
+        run_in_new_thread: bool = True,
         wait_message: str = "Please wait...",
         refresh_time: int = 1000,
         window_param: str = None,
@@ -60,16 +260,16 @@ class Guichet:
                 the GUI's output field. If `True`, regular `print` calls in
                 `main_function` will write to the output field. Defaults to `True`.
             run_in_new_thread (bool, optional): Whether to run the `main_function` in a
-                new thread. This should only be `True` if the `main_function` is slow
-                and you want to avoid blocking the GUI. Read the docs as some caveats
-                apply when running a function in a separate thread. Defaults to `False`.
+                new thread, which keeps the GUI responsive while it runs. Read the docs
+                as some caveats apply when running a function in a separate thread.
+                Functions decorated with `sync` always run in the GUI's thread.
+                Defaults to `True`.
             wait_message (str, optional): The message to be shown in the output field.
             when a users presses the running button and the function has not yet
             finished. Applicable only if `run_in_new_thread` is `True`.
             Defaults to `"Please wait..."`.
-            refresh_time (int, optional): Time (in milliseconds) for the window to check
-                again for new events. Useful only in advanced scenarios where
-                `run_in_new_thread` is `True`. Use the highest value you can afford.
+            refresh_time (int, optional): Deprecated and ignored. The window is now
+                notified as soon as a function running in a new thread finishes.
                 Defaults to `1000`.
             window_param (str, optional): The parameter of the `main_function` to where
                 the GUI's main window object will be passed. Needed only in advanced
@@ -79,8 +279,25 @@ class Guichet:
 
         [1]: https://www.pysimplegui.org/en/latest/cookbook/#themes-window-beautification
         """
+        self._layout = None
+        self._converter_pairs = None
+        self._button = None
+        self._element_cache = {}
+        self._window = None
+        self._gui_thread = None
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        self._theme = None
+        self._applied_theme = None
+        self._output_size = None
+        self._button_label = None
+        self._show_default = None
+        self._ignore_params = frozenset()
+        self._window_param = None
         self.main_function = main_function
-        self.title = title or main_function.__name__
+        self.title = title or getattr(
+            main_function, "__name__", type(main_function).__name__
+        )
         self.output_size = output_size
         self.button_label = button_label
         self.theme = theme
@@ -91,7 +308,67 @@ class Guichet:
         self.wait_message = wait_message
         self.refresh_time = refresh_time
         self.window_param = window_param
-        self.layout = self._make_layout()
+
+    @classmethod
+    def for_function(cls, main_function: Callable, **kwargs) -> "Guichet":
+        """Returns a `Guichet` shared with previous calls with the same arguments.
+
+        Useful to show the GUI of the same function several times, as only the first
+        call creates it. Up to 128 objects are kept. Since the returned object is
+        shared, use `clone` to get a copy before modifying it.
+
+        Args:
+            main_function (Callable): The function in which the GUI is based on.
+            **kwargs: Other arguments, as accepted by `Guichet`.
+
+        Returns:
+            Guichet: The shared object.
+        """
+        if kwargs.get("ignore_params") is not None:
+            kwargs["ignore_params"] = frozenset(kwargs["ignore_params"])
+        key = (cls, main_function, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return cls(main_function, **kwargs)
+        return _shared_guichet(*key)
+
+    @classmethod
+    def cache_clear(cls):
+        """Discards all the objects shared by `for_function`."""
+        _shared_guichet.cache_clear()
+
+    def clone(self) -> "Guichet":
+        """Returns a new `Guichet` with the same settings as this one."""
+        return type(self)(
+            self.main_function,
+            title=self.title,
+            output_size=self.output_size,
+            button_label=self.button_label,
+            theme=self.theme,
+            show_default=self.show_default,
+            ignore_params=self.ignore_params,
+            redirect_stdout=self.redirect_stdout,
+            run_in_new_thread=self.run_in_new_thread,
+            wait_message=self.wait_message,
+            refresh_time=self.refresh_time,
+            window_param=self.window_param,
+        )
+
+    @property
+    def layout(self):
+        # Built lazily so that setting several attributes in a row (as `__init__`
+        # does) only builds the layout once
+        if self._layout is None:
+            self._layout = self._make_layout()
+        return self._layout
+
+    @layout.setter
+    def layout(self, value):
+        self._layout = value
+        # Only known for layouts built by `_make_layout`
+        self._converter_pairs = None
+        self._button = _find_element(value, "-RUN-") if value is not None else None
 
     @property
     def main_function(self):
@@ -103,181 +380,262 @@ class Guichet:
             raise TypeError("'main_function' must be a callable")
 
         self._function = value
-        self._params = self._get_params()
-        self.layout = self._make_layout()
+        self._element_cache.clear()
+        self._layout = None
 
     @property
     def output_size(self):
-        try:
-            return self._output_size
-        except AttributeError:
-            return None
+        return self._output_size
 
     @output_size.setter
     def output_size(self, value):
         self._output_size = value
-        self.layout = self._make_layout()
+        self._layout = None
 
     @property
     def button_label(self):
-        try:
-            return self._button_label
-        except AttributeError:
-            return None
+        return self._button_label
 
     @button_label.setter
     def button_label(self, value):
         self._button_label = value
-        self.layout = self._make_layout()
+        # Relabel the existing button rather than rebuilding the layout. An
+        # assigned layout without a `-RUN-` button is left alone
+        if self._button is not None:
+            self._button.ButtonText = str(value)
+
+    @property
+    def theme(self):
+        return self._theme
+
+    @theme.setter
+    def theme(self, value):
+        self._theme = value
+        self._applied_theme = None
+        # Elements take their colors from the theme when they are created
+        self._element_cache.clear()
+        self._layout = None
 
     @property
     def show_default(self):
-        try:
-            return self._show_default
-        except AttributeError:
-            return None
+        return self._show_default
 
     @show_default.setter
     def show_default(self, value):
         self._show_default = value
-        self.layout = self._make_layout()
+        self._element_cache.clear()
+        self._layout = None
 
     @property
     def ignore_params(self):
-        try:
-            return self._ignore_params
-        except AttributeError:
-            self._ignore_params = []
-            return self._ignore_params
+        return self._ignore_params
 
     @ignore_params.setter
     def ignore_params(self, value):
-        if value is None:
-            self._ignore_params = []
-        else:
-            self._ignore_params = value
-        self.layout = self._make_layout()
+        ignore_params = frozenset(value or ())
+        # The window parameter is never shown in the GUI
+        if self._window_param is not None:
+            ignore_params |= {self._window_param}
+        self._ignore_params = ignore_params
+        self._layout = None
 
     @property
     def window_param(self):
-        try:
-            return self._window_param
-        except AttributeError:
-            return None
+        return self._window_param
 
     @window_param.setter
     def window_param(self, value):
         self._window_param = value
-        if value not in self.ignore_params:
-            self.ignore_params.append(value)
-        self.layout = self._make_layout()
+        if value is not None:
+            self._ignore_params = self._ignore_params | {value}
+        self._layout = None
 
     def _get_params(self):
-        return [
-            p
-            for p in inspect.signature(self.main_function).parameters.values()
-            if not self.ignore_params or p.name not in self.ignore_params
-        ]
+        """Returns a `(name, annotation, default, has_default)` tuple for each
+        parameter shown in the GUI. `annotation` is `None` if there is none."""
+        params = _function_params(self._function)
+        ignore = self._ignore_params
+        if not ignore:
+            return params
+        return tuple(p for p in params if p[0] not in ignore)
 
     def render(self):
-        if self.redirect_stdout:
-            self._output.reroute_stdout_to_here()
-            self._output.reroute_stderr_to_here()
+        layout = self.layout
+        self._apply_theme()
+        window = sg.Window(self.title, layout, finalize=True)
+        # The window now owns these elements, so they must not be reused
+        self._element_cache.clear()
+        self._gui_thread = threading.current_thread()
+        self._window = window
 
-        sg.theme(self.theme)
-        window = sg.Window(self.title, self.layout)
+        redirected = self.redirect_stdout
+        stdout, stderr = sys.stdout, sys.stderr
 
-        if self.run_in_new_thread:
-            executor = ThreadPoolExecutor()
-            future = None
+        try:
+            if redirected:
+                sys.stdout = sys.stderr = _OutputWriter(self, window["-OUTPUT-"])
 
-        while True:
-            if self.run_in_new_thread:
-                if future is not None and future.done():
-                    try:
-                        window["-OUTPUT-"].update(future.result())
-                        future = None
-                    except Exception as e:
-                        window["-OUTPUT-"].update(traceback.format_exc())
+            converter_pairs = self._converter_pairs
+            if converter_pairs is None:
+                converter_pairs = self._make_converter_pairs(self._get_params())
 
-                    continue
+            worker = None
 
-            event, values = window.read(timeout=self.refresh_time)
+            while True:
+                event, values = window.read()
 
-            if event == "Exit" or event == sg.WIN_CLOSED:
-                break
+                if event == "Exit" or event == sg.WIN_CLOSED:
+                    break
 
-            if event == "-RUN-":
-                if self.run_in_new_thread:
-                    if future is not None and not future.done():
+                if event == "-THREAD-DONE-":
+                    worker = None
+                    window["-OUTPUT-"].update(values["-THREAD-DONE-"])
+
+                if event == "-RUN-":
+                    if worker is not None:
                         print(self.wait_message)
                         continue
 
-                # Convert args according to parameter annotations
-                kwargs = {}
-                for p, v in zip(self._get_params(), values.values()):
-                    try:
-                        kwargs[p.name] = p.annotation(v)
-                    except TypeError:
-                        kwargs[p.name] = v
-                if self.window_param:
-                    kwargs[self.window_param] = window
-
-                if self.run_in_new_thread:
-                    future = executor.submit(self.main_function, **kwargs)
-                else:
-                    try:
-                        window["-OUTPUT-"].update(self.main_function(**kwargs))
-                    except Exception as e:
-                        window["-OUTPUT-"].update(traceback.format_exc())
-
-            if event == "-RUN-IN-GUICHET-":
-                values["-RUN-IN-GUICHET-"]()
-
-        window.close()
-        if self.run_in_new_thread:
-            executor.shutdown(wait=False, cancel_futures=True)
-        if self.redirect_stdout:
-            self._output.restore_stdout()
-            self._output.restore_stderr()
+                    kwargs = _convert_args(converter_pairs, values)
+                    if self.window_param:
+                        kwargs[self.window_param] = window
+
+                    if self.run_in_new_thread and not _is_sync(self.main_function):
+                        worker = threading.Thread(
+                            target=self._run_in_thread,
+                            args=(window, kwargs),
+                            daemon=True,
+                        )
+                        worker.start()
+                    else:
+                        try:
+                            output = self.main_function(**kwargs)
+                        except Exception as e:
+                            output = traceback.format_exc()
+                        # Write out what the function printed before showing its
+                        # output
+                        self._run_callbacks()
+                        window["-OUTPUT-"].update(output)
+
+                if event == "-RUN-IN-GUICHET-":
+                    # A callable may also be sent directly with
+                    # `window.write_event_value`
+                    if values["-RUN-IN-GUICHET-"] is not None:
+                        values["-RUN-IN-GUICHET-"]()
+                    self._run_callbacks()
+        finally:
+            # Forget the window first, so that other threads stop posting to it
+            with self._callbacks_lock:
+                self._window = None
+                self._callbacks = []
+            window.close()
+            if redirected:
+                sys.stdout, sys.stderr = stdout, stderr
+            # Elements can't be placed in another window, so the next render needs
+            # a fresh layout
+            self._layout = None
+
+    def post(self, callback: Callable):
+        """Calls `callback` in the GUI's thread.
+
+        Useful when a `main_function` running in a new thread needs to interact with
+        the GUI, for instance to update a progress bar. Callbacks posted in quick
+        succession wake up the GUI only once and are called together. If the GUI is
+        not being rendered, `callback` is called right away, unless it is posted from
+        another thread than the one that rendered the GUI, in which case it is
+        dropped.
+
+        Args:
+            callback (Callable): A function without parameters.
+        """
+        with self._callbacks_lock:
+            window = self._window
+            if window is not None:
+                self._callbacks.append(callback)
+                wake_up = len(self._callbacks) == 1
+
+        if window is None:
+            # Running GUI code from any other thread is not safe
+            gui_thread = self._gui_thread
+            if gui_thread is None or gui_thread is threading.current_thread():
+                callback()
+        elif wake_up:
+            self._write_event(window, "-RUN-IN-GUICHET-", None)
+
+    def _run_callbacks(self):
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _run_in_thread(self, window, kwargs):
+        try:
+            output = self.main_function(**kwargs)
+        except Exception:
+            output = traceback.format_exc()
+
+        # Hand the output over to the event loop, which owns the window
+        self._write_event(window, "-THREAD-DONE-", output)
+
+    def _write_event(self, window, key, value):
+        # Called from other threads, which must not make any Tk calls besides
+        # `write_event_value`. `render` forgets the window before closing it.
+        if self._window is not window:
+            return
+        try:
+            window.write_event_value(key, value)
+        except (AttributeError, RuntimeError, TclError):
+            # The window was closed in the meantime
+            pass
+
+    def _apply_theme(self):
+        # The theme is global to PySimpleGUI, so it may have been changed elsewhere.
+        # PySimpleGUI normalizes theme names, so compare with the name it reports.
+        if self._applied_theme is None or sg.theme() != self._applied_theme:
+            sg.theme(self.theme)
+            self._applied_theme = sg.theme()
 
     def _make_layout(self):
+        self._apply_theme()
         layout = []
 
         # Create the main layout with an appropriate sg element for each parameter
-        for p in self._get_params():
-            kwargs = {}
-            type_origin = get_origin(p.annotation)
-            if type_origin == Literal:
-                sg_element = Guichet._TYPE_MAP[Literal]
-            else:
-                sg_element = Guichet._TYPE_MAP.get(p.annotation, sg.InputText)
-                if isinstance(sg_element, tuple):
-                    sg_element, kwargs = sg_element
-
-            # Handling control args
-            show_default = p.default != inspect._empty and self.show_default
-            if sg_element == sg.Checkbox:
-                kwargs["text"] = ""
-                if show_default:
-                    kwargs["default"] = p.default
-            elif sg_element == sg.Combo:
-                kwargs["values"] = get_args(p.annotation)
-                if show_default:
-                    kwargs["default_value"] = p.default
-            elif sg_element == sg.InputText:
-                if show_default:
-                    kwargs["default_text"] = p.default
-                else:
-                    kwargs["default_text"] = ""
-
-            layout.append([sg.Text(p.name), sg_element(**kwargs)])
+        params = self._get_params()
+        self._converter_pairs = self._make_converter_pairs(params)
+        # Rows are reused across rebuilds until they depend on something that changed
+        # or until their elements are placed in a window, which then owns them
+        cache = self._element_cache
+        for name, annotation, default, has_default in params:
+            row = cache.get(name)
+            if row is None or any(e.ParentContainer is not None for e in row):
+                row = cache[name] = self._make_row(
+                    name, annotation, default, has_default
+                )
+            layout.append(row)
 
         # Add a button to call the function
-        layout.append([sg.Button(self.button_label, key="-RUN-")])
+        self._button = sg.Button(self.button_label, key="-RUN-")
+        layout.append((self._button,))
 
         # Add a multi-line text field to display the output of the function
-        self._output = sg.Multiline(key="-OUTPUT-", size=self.output_size)
-        layout.append([self._output])
+        layout.append((sg.Multiline(key="-OUTPUT-", size=self.output_size),))
 
         return layout
+
+    @staticmethod
+    def _make_converter_pairs(params):
+        return [(name, _converter(annotation)) for name, annotation, _, _ in params]
+
+    def _make_row(self, name, annotation, default, has_default):
+        if get_origin(annotation) == Literal:
+            make_element = _TYPE_MAP[Literal]
+        else:
+            make_element = _TYPE_MAP.get(annotation, _make_input_text)
+
+        show_default = has_default and self.show_default
+        return sg.Text(name), make_element(name, annotation, default, show_default)
+
+
+@lru_cache(maxsize=128)
+def _shared_guichet(cls, main_function, kwargs_items):
+    return cls(main_function, **dict(kwargs_items))
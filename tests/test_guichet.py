@@ -1,10 +1,18 @@
+import os
+import threading
+import time
+from functools import partial, wraps
 from typing import Literal
 
 import PySimpleGUI as sg
 import pytest
 from pydantic import SecretStr
 
-from guichet import Guichet
+from guichet import Guichet, sync
+from guichet.guichet import _OutputWriter, _convert_args, _converter
+
+# Set GUICHET_TEST_FAST=1 to avoid waiting on the slow functions below
+SLOW_FUNCTION_SECONDS = 0.05 if os.environ.get("GUICHET_TEST_FAST") else 5
 
 
 # Elements in PySimpleGUI need to be in a window to be properly tested
@@ -15,6 +23,15 @@ def rendered_element(element):
     return element
 
 
+# Shared by the tests of a class, which must not modify it
+@pytest.fixture(scope="class")
+def default_gui():
+    def f(x):
+        pass
+
+    return Guichet(f)
+
+
 class TestGuichet:
     def test_simple_function(self):
         def concat(word_1, word_2):
@@ -36,47 +53,84 @@ class TestGuichet:
         assert isinstance(gui.layout[2][0], sg.Button)
         assert isinstance(gui.layout[3][0], sg.Multiline)
 
-    def test_function_with_int_annotation(self):
-        def f(x: int):
-            pass
-
-        gui = Guichet(f)
-        assert isinstance(gui.layout[0][1], sg.InputText)
+    def test_layout_built_once(self, monkeypatch):
+        calls = []
+        make_layout = Guichet._make_layout
 
-    def test_function_with_float_annotation(self):
-        def f(x: float):
-            pass
+        def counting_make_layout(self):
+            calls.append(self)
+            return make_layout(self)
 
-        gui = Guichet(f)
-        assert isinstance(gui.layout[0][1], sg.InputText)
+        monkeypatch.setattr(Guichet, "_make_layout", counting_make_layout)
 
-    def test_function_with_str_annotation(self):
-        def f(x: str):
-            pass
+        gui = Guichet(lambda x: x, ignore_params=["y"], window_param="w")
+        assert len(calls) == 0
+        gui.layout
+        gui.layout
+        assert len(calls) == 1
 
-        gui = Guichet(f)
-        assert isinstance(gui.layout[0][1], sg.InputText)
+    def test_input_keys(self):
+        def concat(word_1, word_2):
+            return word_1 + word_2
 
-    def test_function_with_bool_annotation(self):
-        def f(x: bool):
+        gui = Guichet(concat)
+        assert gui.layout[0][1].Key == "word_1"
+        assert gui.layout[1][1].Key == "word_2"
+
+    @pytest.mark.parametrize(
+        "annotation, element_class",
+        [
+            (int, sg.InputText),
+            (float, sg.InputText),
+            (str, sg.InputText),
+            (bool, sg.Checkbox),
+            (SecretStr, sg.InputText),
+            (Literal["foo", "bar"], sg.Combo),
+        ],
+    )
+    def test_function_with_annotation(self, annotation, element_class):
+        def f(x: annotation):
             pass
 
         gui = Guichet(f)
-        assert isinstance(gui.layout[0][1], sg.Checkbox)
+        assert isinstance(gui.layout[0][1], element_class)
+
+    @pytest.mark.parametrize(
+        "annotation, converter",
+        [
+            (int, int),
+            (float, float),
+            (SecretStr, SecretStr),
+            (str, None),
+            (bool, None),
+            (Literal["foo", "bar"], None),
+            (None, None),
+        ],
+    )
+    def test_converter(self, annotation, converter):
+        assert _converter(annotation) is converter
+
+    def test_convert_args(self):
+        converter_pairs = [("x", int), ("y", float), ("z", None)]
+        values = {"x": "3", "y": "", "z": "foo"}
+        # Values that fail to convert, such as float(""), are passed as they are
+        assert _convert_args(converter_pairs, values) == {"x": 3, "y": "", "z": "foo"}
+
+    def test_convert_args_by_position(self):
+        converter_pairs = [("x", int), ("y", None)]
+        assert _convert_args(converter_pairs, {0: "3", 1: "foo"}) == {
+            "x": 3,
+            "y": "foo",
+        }
+        with pytest.raises(KeyError, match="'y'"):
+            _convert_args(converter_pairs, {0: "3"})
 
     def test_function_with_secret_str_annotation(self):
         def f(x: SecretStr):
             pass
 
         gui = Guichet(f)
-        assert isinstance(gui.layout[0][1], sg.InputText)
-
-    def test_function_with_literal_annotation(self):
-        def f(x: Literal["foo", "bar"]):
-            pass
-
-        gui = Guichet(f)
-        assert isinstance(gui.layout[0][1], sg.Combo)
+        assert gui.layout[0][1].PasswordCharacter == "*"
 
     def test_function_with_int_default_value(self):
         default_value = 3
@@ -104,6 +158,14 @@ class TestGuichet:
         combo = rendered_element(gui.layout[0][1])
         assert combo.get() is not default_value
 
+    def test_function_with_keyword_only_default_value(self):
+        def f(x, *, y: int = 3):
+            pass
+
+        gui = Guichet(f)
+        assert gui.layout[0][1].DefaultText == ""
+        assert gui.layout[1][1].DefaultText == 3
+
     def test_function_with_ignored_parameter(self):
         def f(x: int, ignored=None):
             pass
@@ -111,34 +173,119 @@ class TestGuichet:
         gui = Guichet(f, ignore_params=["ignored"])
         assert len(gui.layout) == 3
 
+    def test_window_param_not_shown(self):
+        def f(x, win=None):
+            pass
+
+        gui = Guichet(f, window_param="win")
+        assert len(gui.layout) == 3
+
+        gui.ignore_params = ["x"]
+        assert len(gui.layout) == 2
+
     def test_simple_lambda(self):
         gui = Guichet(lambda x: x)
         assert len(gui.layout) == 3
 
-    def test_button_label(self):
+    def test_partial(self):
+        def f(x, y: int, z: bool = True):
+            pass
+
+        gui = Guichet(partial(f, 1))
+        assert gui.title == "partial"
+        assert len(gui.layout) == 4
+        assert isinstance(gui.layout[0][1], sg.InputText)
+        assert isinstance(gui.layout[1][1], sg.Checkbox)
+
+    def test_wrapped_function(self):
+        def f(x: bool):
+            pass
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            return f(*args, **kwargs)
+
+        gui = Guichet(wrapper)
+        assert len(gui.layout) == 3
+        assert isinstance(gui.layout[0][1], sg.Checkbox)
+
+    def test_button_label(self, default_gui):
         def f(x):
             pass
 
-        gui1 = Guichet(f)
-        assert gui1.layout[1][0].get_text() == "Run"
+        assert default_gui.layout[1][0].get_text() == "Run"
 
         gui2 = Guichet(f, button_label="Go")
         assert gui2.layout[1][0].get_text() == "Go"
+        layout = gui2.layout
         gui2.button_label = "Execute"
         assert gui2.layout[1][0].get_text() == "Execute"
+        assert gui2.layout is layout
 
-    def test_theme(self):
+    def test_button_label_with_custom_layout(self):
+        gui = Guichet(lambda x: x)
+        button = sg.Button("Run", key="-RUN-")
+        layout = [(sg.Text("Custom"),), (button,)]
+        gui.layout = layout
+        gui.button_label = "Go"
+        assert gui.layout is layout
+        assert button.get_text() == "Go"
+
+    def test_button_label_with_custom_layout_without_button(self):
+        gui = Guichet(lambda x: x)
+        text = sg.Text("Custom")
+        layout = [(text,)]
+        gui.layout = layout
+        gui.button_label = "Go"
+        assert gui.layout is layout
+        assert gui.layout == [(text,)]
+
+    def test_theme(self, default_gui):
         def f(x):
             pass
 
-        gui1 = Guichet(f)
-        assert gui1.theme == "Dark Blue 3"
+        assert default_gui.theme == "Dark Blue 3"
 
         gui2 = Guichet(f, theme="DarkAmber")
         assert gui2.theme == "DarkAmber"
         gui2.theme = "DarkPurple"
         assert gui2.theme == "DarkPurple"
 
+    def test_layout_uses_theme(self):
+        def f(x):
+            pass
+
+        gui = Guichet(f, theme="DarkAmber")
+        background = sg.LOOK_AND_FEEL_TABLE["DarkAmber"]["BACKGROUND"]
+        assert gui.layout[0][0].BackgroundColor == background
+
+        gui.theme = "DarkPurple"
+        background = sg.LOOK_AND_FEEL_TABLE["DarkPurple"]["BACKGROUND"]
+        assert gui.layout[0][0].BackgroundColor == background
+
+    def test_theme_applied_once(self, monkeypatch):
+        theme = sg.theme
+        applied = []
+
+        def counting_theme(new_theme=None):
+            if new_theme is not None:
+                applied.append(new_theme)
+            return theme(new_theme)
+
+        monkeypatch.setattr(sg, "theme", counting_theme)
+
+        gui = Guichet(lambda x="foo": x)
+        gui.layout
+        gui.show_default = False
+        gui.layout
+        gui.ignore_params = ["x"]
+        gui.layout
+        assert applied == ["Dark Blue 3"]
+
+        gui.theme = "DarkAmber"
+        gui.layout
+        assert applied == ["Dark Blue 3", "DarkAmber"]
+
     def test_show_default(self):
         def f(x="foo"):
             pass
@@ -157,6 +304,109 @@ class TestGuichet:
         gui3 = Guichet(f2)
         assert gui3.layout[0][1].DefaultText == ""
 
+    def test_rows_reused_across_rebuilds(self):
+        def f(x="foo", y="bar"):
+            pass
+
+        gui = Guichet(f)
+        row = gui.layout[0]
+        gui.button_label = "Go"
+        assert gui.layout[0] is row
+
+        gui.ignore_params = ["x"]
+        assert gui.layout[0][0].DisplayText == "y"
+        gui.ignore_params = None
+        assert gui.layout[0] is row
+
+        gui.show_default = False
+        assert gui.layout[0] is not row
+        assert gui.layout[0][1].DefaultText == ""
+
+        # Elements placed in a window can't be placed in another one
+        row = gui.layout[0]
+        sg.Window("Test", [row])
+        gui.button_label = "Run"
+        gui.output_size = (30, 10)
+        assert gui.layout[0] is not row
+
+    def test_output_writer_batches_writes(self):
+        class StubGuichet:
+            def __init__(self):
+                self.posted = []
+
+            def post(self, callback):
+                self.posted.append(callback)
+
+        class StubElement:
+            def __init__(self):
+                self.updates = []
+
+            def update(self, value, append=False):
+                self.updates.append((value, append))
+
+        gui = StubGuichet()
+        element = StubElement()
+        writer = _OutputWriter(gui, element)
+        chunks = ["a", "b\n", "c"]
+        for chunk in chunks:
+            assert writer.write(chunk) == len(chunk)
+        assert len(gui.posted) == 1
+
+        gui.posted[0]()
+        assert element.updates == [("".join(chunks), True)]
+
+        writer.write("d")
+        assert len(gui.posted) == 2
+        gui.posted[1]()
+        assert element.updates[-1] == ("d", True)
+
+    def test_post_without_rendering(self):
+        gui = Guichet(lambda x: x)
+        calls = []
+        gui.post(lambda: calls.append(1))
+        assert calls == [1]
+
+    def test_for_function(self):
+        def f(x, y):
+            pass
+
+        Guichet.cache_clear()
+        gui = Guichet.for_function(f, button_label="Go")
+        assert Guichet.for_function(f, button_label="Go") is gui
+        assert Guichet.for_function(f) is not gui
+
+        gui = Guichet.for_function(f, ignore_params=["y"])
+        assert Guichet.for_function(f, ignore_params=["y"]) is gui
+        assert len(gui.layout) == 3
+
+        Guichet.cache_clear()
+        assert Guichet.for_function(f, ignore_params=["y"]) is not gui
+
+    def test_clone(self):
+        def f(x, y, win=None):
+            pass
+
+        gui = Guichet(f, button_label="Go", ignore_params=["y"], window_param="win")
+        clone = gui.clone()
+        assert clone is not gui
+        assert clone.layout is not gui.layout
+        assert clone.button_label == "Go"
+        assert clone.window_param == "win"
+        assert len(clone.layout) == 3
+
+    def test_post_after_rendering_from_other_thread(self):
+        gui = Guichet(lambda x: x)
+        # As if the GUI had been rendered and closed in the main thread
+        gui._gui_thread = threading.main_thread()
+        calls = []
+        thread = threading.Thread(target=gui.post, args=(lambda: calls.append(1),))
+        thread.start()
+        thread.join()
+        assert calls == []
+
+        gui.post(lambda: calls.append(2))
+        assert calls == [2]
+
     @pytest.mark.skip(reason="Doesn't work. Don't know why.")
     def test_output_size(self):
         def f(x):
@@ -224,25 +474,21 @@ class TestRendering:
         gui.render()
 
     def test_rendering_slow_function(self):
-        import time
-
         def slow_function():
             print(f"Running slow function at {time.time()}...")
-            time.sleep(5)
+            time.sleep(SLOW_FUNCTION_SECONDS)
             print("Done!")
 
-        gui = Guichet(slow_function)
+        gui = Guichet(slow_function, run_in_new_thread=False)
         gui.render()
 
     def test_rendering_slow_function_in_new_thread(self):
-        import time
-
         def slow_function():
             print(f"Running slow function at {time.time()}...")
-            time.sleep(5)
+            time.sleep(SLOW_FUNCTION_SECONDS)
             print("Done!")
 
-        gui = Guichet(slow_function, run_in_new_thread=True)
+        gui = Guichet(slow_function)
         gui.render()
 
     def test_progress_bar(self):
@@ -260,6 +506,27 @@ class TestRendering:
         gui = Guichet(counter, window_param="win")
         gui.render()
 
+    def test_progress_bar_with_post(self):
+        def counter():
+            n = 100
+            for i in range(n):
+
+                def progress_bar(current_value=i + 1):
+                    return sg.one_line_progress_meter("Progress bar", current_value, n)
+
+                gui.post(progress_bar)
+
+        gui = Guichet(counter)
+        gui.render()
+
+    def test_sync(self):
+        @sync
+        def greet(name: str):
+            sg.popup(f"Hello, {name}!")
+
+        gui = Guichet(greet)
+        gui.render()
+
     def test_theme(self):
         def hello_world():
             print("Hello world!")